@@ -1,10 +1,26 @@
 import streamlit as st
-from youtube_transcript_api import YouTubeTranscriptApi
-from groq import Groq
+import streamlit.components.v1 as components
+from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound, RequestBlocked, YouTubeRequestFailed
+from youtube_transcript_api.proxies import GenericProxyConfig
 from dotenv import load_dotenv
 import os
-import yt_dlp
+import requests
 import tempfile
+import hashlib
+import time
+import asyncio
+import queue
+import threading
+import glob
+import subprocess
+import shutil
+import csv
+import json
+import functools
+import html
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
+from utils import cache, TRANSCRIPT_TTL, SUMMARY_TTL, transcript_key, get_video_id, format_transcript, chunk_text
 
 # Load environment variables
 load_dotenv()
@@ -14,32 +30,64 @@ if not GROQ_API_KEY:
     st.error("GROQ_API_KEY not found in .env file. Please add it and restart the app.")
     st.stop()
 
-# Initialize Groq client
-client = Groq(api_key=GROQ_API_KEY)
-
-# Function to extract video ID from URL
-def get_video_id(url):
-    if "youtu.be" in url:
-        return url.split("/")[-1].split("?")[0]
-    elif "youtube.com" in url:
-        if "v=" in url:
-            return url.split("v=")[1].split("&")[0]
-        elif "list=" in url:
-            st.warning("Playlists are not supported. Please provide a single video link.")
-            return None
-    else:
-        raise ValueError("Invalid YouTube URL")
+# groq, httpx and yt_dlp are imported on first use to keep Streamlit cold start fast;
+# the subtitles-only path never loads them.
+
+# HTTP/2 with a small keepalive pool so streamed chunks share one warm connection;
+# the long read timeout covers slow summary streams
+def groq_http_options():
+    import httpx
+    return dict(
+        http2=True,
+        timeout=httpx.Timeout(600.0, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300),
+    )
+
+# The Groq client is cached across reruns so HTTP connections are reused
+@st.cache_resource
+def get_groq():
+    import httpx
+    from groq import Groq
+    return Groq(api_key=GROQ_API_KEY, http_client=httpx.Client(**groq_http_options()))
+
+# AsyncGroq is bound to the event loop it runs on, so build one per asyncio.run call
+def new_async_groq():
+    import httpx
+    from groq import AsyncGroq
+    return AsyncGroq(api_key=GROQ_API_KEY, http_client=httpx.AsyncClient(**groq_http_options()))
+
+# YouTubeTranscriptApi wraps a requests.Session and is not thread-safe, so build one per fetch
+def get_yt_api(proxy=None):
+    proxy_config = GenericProxyConfig(http_url=proxy, https_url=proxy) if proxy else None
+    return YouTubeTranscriptApi(proxy_config=proxy_config)
+
+# Sentinel for disk cache lookups; get() avoids a race with expiry between a membership test and a read
+_MISSING = object()
 
-# Function to download audio using yt-dlp
-def download_audio(video_url, proxy=None, cookies_file=None):
+LANG_OPTIONS = ('en', 'de', 'fr', 'es', 'it', 'ja', 'ko', 'zh', 'other')
+
+# Coalesce streamed tokens so the placeholder is re-rendered at most every
+# STREAM_FLUSH_INTERVAL seconds or STREAM_FLUSH_CHARS characters
+STREAM_FLUSH_INTERVAL = 0.04
+STREAM_FLUSH_CHARS = 4096
+
+# Whisper fallback: audio is split into fixed-length chunks transcribed concurrently
+WHISPER_MODEL = "whisper-large-v3"
+AUDIO_SEGMENT_SECONDS = 300
+WHISPER_MAX_BYTES = 25 * 1024 * 1024  # Groq upload limit
+WHISPER_CONCURRENCY = 8  # Bound in-flight Whisper requests to stay under rate limits
+
+# Long transcripts are summarized map-reduce style: segments in parallel on a
+# small model, then one streamed pass over the segment summaries
+SUMMARY_MAP_MODEL = "llama-3.1-8b-instant"
+SUMMARY_MAP_WORKERS = 8
+
+# Function to download audio using yt-dlp (native container, no re-encoding)
+def download_audio(video_url, tmpdir, proxy=None, cookies_file=None):
+    import yt_dlp
     ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': 'audio.%(ext)s',
+        'format': 'bestaudio[ext=m4a]/bestaudio',
+        'outtmpl': os.path.join(tmpdir, 'audio.%(ext)s'),
         'quiet': True,
         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     }
@@ -49,74 +97,250 @@ def download_audio(video_url, proxy=None, cookies_file=None):
         ydl_opts['cookiefile'] = cookies_file
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         ydl.download([video_url])
-    return 'audio.mp3'
+    return glob.glob(os.path.join(tmpdir, 'audio.*'))[0]
 
-# Function to get transcript (with fallback to Whisper)
-def get_transcript(video_id, languages=['en'], fallback=False, video_url=None, proxy=None, cookies_file=None):
+# Function to shrink audio to mono 16 kHz Opus when it exceeds the Whisper upload limit
+def compress_audio(audio_file):
+    if os.path.getsize(audio_file) <= WHISPER_MAX_BYTES:
+        return audio_file
+    compressed = f"{os.path.splitext(audio_file)[0]}_16k.ogg"
+    subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-y', '-i', audio_file,
+         '-ac', '1', '-ar', '16000', '-c:a', 'libopus', '-b:a', '24k', compressed],
+        check=True, capture_output=True
+    )
+    return compressed
+
+# Function to split audio into chunks without re-encoding, returning (path, start offset) pairs
+def split_audio(audio_file, segment_seconds=AUDIO_SEGMENT_SECONDS):
+    base, ext = os.path.splitext(audio_file)
+    segment_list = f"{base}_chunks.csv"
+    subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-y', '-i', audio_file,
+         '-f', 'segment', '-segment_time', str(segment_seconds), '-c', 'copy',
+         '-reset_timestamps', '1',  # Each chunk starts at 0; the CSV offset is the only shift applied
+         '-segment_list', segment_list, '-segment_list_type', 'csv',
+         f"{base}_chunk_%03d{ext}"],
+        check=True, capture_output=True
+    )
+    # Stream copy can only cut on packet boundaries, so use the actual start times ffmpeg reports
+    with open(segment_list, newline="") as f:
+        return [
+            (os.path.join(os.path.dirname(audio_file), name), float(start))
+            for name, start, _ in csv.reader(f)
+        ]
+
+# Function to download and transcribe audio, overlapping the Whisper calls per chunk
+async def transcribe_audio(video_url, tmpdir, proxy=None, cookies_file=None):
+    loop = asyncio.get_running_loop()
+    # yt-dlp and ffmpeg are blocking, keep them off the event loop
+    audio_file = await loop.run_in_executor(None, download_audio, video_url, tmpdir, proxy, cookies_file)
+    async_client = new_async_groq()
+    progress = st.progress(0.0, text="Transcribing audio...")
+    tasks = []
     try:
-        api = YouTubeTranscriptApi(proxies={"http": proxy, "https": proxy} if proxy else None)
-        transcript = api.fetch(video_id, languages=languages)
-        full_text = " ".join([entry['text'] for entry in transcript])
-        return full_text, transcript  # Return both plain text and raw for formatted display
-    except Exception as e:
-        if fallback and video_url:
-            st.info("No subtitles available. Falling back to audio transcription using Groq Whisper...")
-            try:
-                audio_file = download_audio(video_url, proxy, cookies_file)
-                with open(audio_file, "rb") as file:
-                    transcription = client.audio.transcriptions.create(
+        chunks = await loop.run_in_executor(None, split_audio, audio_file)
+
+        semaphore = asyncio.Semaphore(WHISPER_CONCURRENCY)
+
+        async def transcribe_chunk(index, path, offset):
+            path = await loop.run_in_executor(None, compress_audio, path)
+            async with semaphore:
+                with open(path, "rb") as file:
+                    transcription = await async_client.audio.transcriptions.create(
                         file=file,
-                        model="whisper-large-v3",
+                        model=WHISPER_MODEL,
                         response_format="verbose_json",
                         timestamp_granularities=["segment"]
                     )
-                full_text = transcription.text
-                raw_transcript = transcription.segments  # List of {'start': float, 'end': float, 'text': str}
-                os.remove(audio_file)  # Clean up
-                return full_text, raw_transcript
+            segments = [
+                {**segment, 'start': segment['start'] + offset, 'end': segment['end'] + offset}
+                for segment in transcription.segments
+            ]
+            return index, transcription.text, segments
+
+        results = [None] * len(chunks)
+        tasks = [
+            asyncio.create_task(transcribe_chunk(index, path, offset))
+            for index, (path, offset) in enumerate(chunks)
+        ]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            index, text, segments = await task
+            results[index] = (text, segments)
+            progress.progress(done / len(chunks), text=f"Transcribed {done}/{len(chunks)} audio chunks")
+    finally:
+        progress.empty()
+        # If a chunk failed, stop the remaining uploads before closing the client under them
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await async_client.close()
+
+    full_text = " ".join(text.strip() for text, _ in results)
+    raw_transcript = [segment for _, segments in results for segment in segments]  # List of {'start': float, 'end': float, 'text': str}
+    return full_text, raw_transcript
+
+# Function to fetch subtitles, retrying transient failures (e.g. 429s on cloud IPs) with backoff.
+# Everything else (missing subtitles, invalid or restricted videos) is deterministic and raised immediately.
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_exponential_jitter(initial=1, max=15),
+    retry=retry_if_exception_type((RequestBlocked, YouTubeRequestFailed, requests.ConnectionError, requests.Timeout)),
+    reraise=True
+)
+def _fetch(api, video_id, languages):
+    return api.fetch(video_id, languages=languages)
+
+# Function to load a transcript as (plain text, raw entries). Lookups go memory (st.cache_data,
+# process-wide) -> disk (persistent, also holds Whisper results) -> YouTube subtitles.
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_captions(video_id, languages, proxy=None):
+    key = transcript_key(video_id, languages)
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    transcript = _fetch(get_yt_api(proxy), video_id, languages).to_raw_data()  # List of {'text', 'start', 'duration'} dicts
+    full_text = " ".join(entry['text'] for entry in transcript)
+    result = (full_text, transcript)  # Return both plain text and raw for formatted display
+    cache.set(key, result, expire=TRANSCRIPT_TTL)
+    return result
+
+# Function to get transcript (with fallback to Whisper); languages must be a tuple
+def get_transcript(video_id, languages=('en',), fallback=False, video_url=None, proxy=None, cookies_file=None, workdir=None):
+    try:
+        return load_captions(video_id, languages, proxy or None)
+    except (TranscriptsDisabled, NoTranscriptFound) as e:
+        if fallback and video_url:
+            st.info("No subtitles available. Falling back to audio transcription using Groq Whisper...")
+            try:
+                # Audio lives in its own directory under the request workdir, so concurrent sessions never share files
+                with tempfile.TemporaryDirectory(prefix="ytsum_", dir=workdir) as tmpdir:
+                    full_text, raw_transcript = asyncio.run(transcribe_audio(video_url, tmpdir, proxy, cookies_file))
+                result = (full_text, list(raw_transcript))
+                # Stored under the same key, so the next load_captions call finds it on disk
+                cache.set(transcript_key(video_id, languages), result, expire=TRANSCRIPT_TTL)
+                return result
             except Exception as download_e:
                 raise ValueError(f"Failed to download audio for transcription: {str(download_e)}")
         else:
             raise ValueError(f"Could not fetch transcript: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"Could not fetch transcript: {str(e)}")
 
-# Function to format transcript with timestamps
-def format_transcript(raw_transcript):
-    formatted = ""
-    for entry in raw_transcript:
-        if 'start' in entry and 'end' in entry:  # For Whisper format
-            start_time = f"{int(entry['start'] // 60):02d}:{int(entry['start'] % 60):02d}"
-            end_time = f"{int(entry['end'] // 60):02d}:{int(entry['end'] % 60):02d}"
-            formatted += f"[{start_time} - {end_time}] {entry['text']}\n"
-        else:  # For YouTube format
-            start_time = f"{int(entry['start'] // 60):02d}:{int(entry['start'] % 60):02d}"
-            formatted += f"[{start_time}] {entry['text']}\n"
-    return formatted
-
-# Function to generate summary using Groq with streaming
-def generate_summary(transcript, custom_prompt="Summarize the following transcript:", model="mixtral-8x7b-32768"):
-    content = f"{custom_prompt} {transcript}"
+# Function to summarize one transcript segment (map step, non-streaming)
+def summarize_segment(client, segment):
     completion = client.chat.completions.create(
-        model=model,  # Changed to a valid Groq model; adjust as needed
+        model=SUMMARY_MAP_MODEL,
         messages=[
+            {
+                "role": "system",
+                "content": "Summarize this segment:"
+            },
             {
                 "role": "user",
-                "content": content
+                "content": segment
             }
         ],
         temperature=1,
-        max_tokens=8192,
+        max_tokens=1024,
         top_p=1,
-        stream=True,
+        stream=False,
         stop=None
     )
-    
-    summary = ""
+    return completion.choices[0].message.content or ""
+
+# Function to stream a chat completion on a background thread, keeping the script thread free to render.
+# Token deltas are put on out_queue, followed by None; an exception is put before None on failure.
+# Setting stop closes the stream early (e.g. the script was rerun or stopped mid-generation).
+def stream_completion(client, out_queue, stop, **kwargs):
+    try:
+        stream = client.chat.completions.create(stream=True, **kwargs)
+        for chunk in stream:
+            if stop.is_set():
+                stream.close()
+                return
+            out_queue.put(chunk.choices[0].delta.content or "")
+    except Exception as e:
+        out_queue.put(e)
+    finally:
+        out_queue.put(None)
+
+# Function to generate summary using Groq with streaming
+def generate_summary(transcript, custom_prompt="Summarize the following transcript:", model="mixtral-8x7b-32768"):
+    key = ('summ', hashlib.sha256(f"{custom_prompt}{model}{transcript}".encode()).hexdigest())
     summary_placeholder = st.empty()
-    for chunk in completion:
-        content = chunk.choices[0].delta.content or ""
-        summary += content
-        summary_placeholder.markdown(summary + " ▌")  # Add cursor for streaming effect
+    # Two-tier lookup: this session's memo first, then the shared disk cache
+    session_cache = st.session_state.setdefault("summ_cache", {})
+    if key in session_cache:
+        summary = session_cache[key]
+        summary_placeholder.markdown(summary)
+        return summary
+    cached = cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        summary = session_cache[key] = cached
+        summary_placeholder.markdown(summary)
+        return summary
+
+    # Resolve the cached client on the script thread; worker threads have no ScriptRunContext
+    client = get_groq()
+    segments = chunk_text(transcript)
+    if len(segments) > 1:
+        with st.spinner(f"Summarizing {len(segments)} transcript segments..."):
+            with ThreadPoolExecutor(max_workers=SUMMARY_MAP_WORKERS) as executor:
+                transcript = "\n\n".join(executor.map(functools.partial(summarize_segment, client), segments))
+
+    tokens = queue.Queue()
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=stream_completion,
+        args=(client, tokens, stop),
+        kwargs=dict(
+            model=model,  # Changed to a valid Groq model; adjust as needed
+            # Static instructions go in the system message so the prefix is shared across calls
+            messages=[
+                {
+                    "role": "system",
+                    "content": custom_prompt
+                },
+                {
+                    "role": "user",
+                    "content": transcript
+                }
+            ],
+            temperature=1,
+            max_tokens=8192,
+            top_p=1,
+            stop=None
+        ),
+        daemon=True
+    )
+    producer.start()
+
+    summary = ""
+    pending = 0
+    last_flush = time.monotonic()
+    try:
+        while True:
+            try:
+                item = tokens.get(timeout=STREAM_FLUSH_INTERVAL)
+            except queue.Empty:
+                item = ""
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            summary += item
+            pending += len(item)
+            now = time.monotonic()
+            if pending and (pending >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL):
+                summary_placeholder.markdown(summary + " ▌")  # Add cursor for streaming effect
+                pending = 0
+                last_flush = now
+    finally:
+        stop.set()  # Rerun/stop exceptions land here; don't keep pulling tokens nobody will read
     summary_placeholder.markdown(summary)  # Final update without cursor
+    cache.set(key, summary, expire=SUMMARY_TTL)
+    session_cache[key] = summary
     return summary
 
 # Streamlit UI
@@ -132,8 +356,8 @@ If you encounter 403 errors, try providing a cookies file (export from your brow
 # Sidebar for options
 with st.sidebar:
     st.header("Settings")
-    languages = st.multiselect("Preferred Languages", options=['en', 'de', 'fr', 'es', 'it', 'ja', 'ko', 'zh', 'other'], default=['en'],
-                               help="Select languages in priority order. Defaults to English.")
+    languages = tuple(st.multiselect("Preferred Languages", options=LANG_OPTIONS, default=('en',),
+                                     help="Select languages in priority order. Defaults to English.")) or ('en',)
     custom_prompt = st.text_input("Custom Summary Prompt", value="Summarize the following transcript:",
                                   help="Customize the prompt sent to the AI for summarization, e.g., 'Summarize key points from:'")
     generate_summary_option = st.checkbox("Generate AI Summary", value=True, help="Uncheck if you only want the transcript.")
@@ -156,9 +380,11 @@ with col1:
 
 if st.button("Process Video", use_container_width=True):
     if video_url:
+        # Scratch space for this request (cookies, audio), removed in one shot afterwards
+        workdir = tempfile.mkdtemp(prefix="ytsum_")
         cookies_file = None
         if cookies_upload:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp:
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".txt", dir=workdir) as tmp:
                 tmp.write(cookies_upload.read())
                 cookies_file = tmp.name
 
@@ -166,15 +392,26 @@ if st.button("Process Video", use_container_width=True):
             try:
                 video_id = get_video_id(video_url)
                 if not video_id:
+                    st.warning("Playlists are not supported. Please provide a single video link.")
                     st.stop()
-                transcript_text, raw_transcript = get_transcript(video_id, languages if languages else ['en'], 
-                                                                fallback=fallback_transcription, video_url=video_url, proxy=proxy, cookies_file=cookies_file)
+                transcript_text, raw_transcript = get_transcript(video_id, languages, 
+                                                                fallback=fallback_transcription, video_url=video_url, proxy=proxy, cookies_file=cookies_file,
+                                                                workdir=workdir)
                 st.success("Transcript obtained successfully!")
                 
+                # Format once per transcript and reuse it on later reruns
+                formatted_key = transcript_key(video_id, languages)
+                cached = st.session_state.get("formatted_transcript")
+                if cached and cached[0] == formatted_key:
+                    formatted_transcript = cached[1]
+                else:
+                    formatted_transcript = format_transcript(raw_transcript)
+                    st.session_state["formatted_transcript"] = (formatted_key, formatted_transcript)
+
                 # Always display formatted transcript in a good way
                 st.subheader("Complete Transcript (with Timestamps)")
-                formatted_transcript = format_transcript(raw_transcript)
-                st.text_area("Formatted Transcript", formatted_transcript, height=400)
+                with st.expander("Show Full Transcript (with Timestamps)", expanded=False):
+                    st.code(formatted_transcript, language=None)
                 
                 # Option to download transcript
                 st.download_button(
@@ -192,18 +429,24 @@ if st.button("Process Video", use_container_width=True):
                     st.subheader("AI-Generated Summary")
                     st.markdown(summary)
                     
-                    # Add copy button for summary
-                    st.button("Copy Summary", on_click=lambda: st.session_state.update({"summary": summary}))
-                    if "summary" in st.session_state:
-                        st.code(st.session_state["summary"], language="text")
-
-                if cookies_file:
-                    os.unlink(cookies_file)  # Clean up temp file
+                    # Download or copy the summary client-side, without re-rendering it
+                    st.download_button(
+                        label="Download Summary",
+                        data=summary,
+                        file_name="summary.md",
+                        mime="text/markdown"
+                    )
+                    components.html(
+                        f'<button onclick="navigator.clipboard.writeText({html.escape(json.dumps(summary))})">Copy Summary</button>',
+                        height=40
+                    )
             except ValueError as ve:
                 st.error(str(ve))
                 st.info("Tip: For 403 errors, try uploading a cookies.txt file from your browser or using a proxy. Alternatively, run the app locally.")
             except Exception as e:
                 st.error(f"An unexpected error occurred: {str(e)}")
                 st.info("If the error persists, ensure the video has public access, try cookies/proxy, or verify yt-dlp compatibility.")
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)  # Clean up temp files
     else:
         st.warning("Please enter a valid YouTube video link.")
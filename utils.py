@@ -0,0 +1,84 @@
+import functools
+import re
+from diskcache import Cache
+
+# On-disk cache for transcripts and summaries, shared across reruns and sessions
+cache = Cache('.cache')
+TRANSCRIPT_TTL = 7 * 86400
+SUMMARY_TTL = 86400
+
+# Function to build the disk cache key for a transcript (shared by subtitles and Whisper results)
+def transcript_key(video_id, languages):
+    return ('txn', video_id, languages)
+
+# Transcript window size for map-reduce summarization
+SUMMARY_CHUNK_TOKENS = 3000
+
+_YT_RE = re.compile(r'(?:youtu\.be/|youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|v/))([A-Za-z0-9_-]{11})')
+
+# Function to extract video ID from URL
+def get_video_id(url):
+    match = _YT_RE.search(url)
+    if match:
+        return match.group(1)
+    if "youtube.com" in url and "list=" in url:
+        return None  # Playlist links are not supported
+    raise ValueError("Invalid YouTube URL")
+
+# Function to format transcript with timestamps
+def format_transcript(raw_transcript):
+    if not raw_transcript:
+        return ""
+    # Both sources use one schema per transcript, so dispatch once instead of per entry
+    if 'end' in raw_transcript[0]:  # For Whisper format
+        lines = [f"[{_mmss(e['start'])} - {_mmss(e['end'])}] {e['text']}" for e in raw_transcript]
+    else:  # For YouTube format
+        lines = [f"[{_mmss(e['start'])}] {e['text']}" for e in raw_transcript]
+    return "\n".join(lines) + "\n"
+
+def _mmss(seconds):
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{secs:02d}"
+
+# Sentence ends: Latin terminators followed by whitespace, or CJK terminators (no space follows them)
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|(?<=[。！？])\s*')
+
+# tiktoken is optional and downloads its BPE file on first use, so load it lazily
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None  # Not installed or offline: fall back to counting whitespace-separated words
+
+def _count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(text.split()) * 4 // 3  # English averages ~1.3 tokens per word
+
+# Function to split text into windows of roughly max_tokens at sentence boundaries
+def chunk_text(text, max_tokens=SUMMARY_CHUNK_TOKENS):
+    chunks, current, current_tokens = [], [], 0
+    for sentence in _SENTENCE_RE.split(text):
+        if not sentence:
+            continue  # A trailing CJK terminator leaves an empty tail
+        tokens = _count_tokens(sentence)
+        if tokens > max_tokens:
+            # Auto-generated captions often have no punctuation; split on words instead
+            words = sentence.split()
+            step = max(1, len(words) * max_tokens // tokens)
+            pieces = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            piece_tokens = _count_tokens(piece) if len(pieces) > 1 else tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks